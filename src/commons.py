@@ -1,3 +1,5 @@
+import logging
+
 
 class NonExistentS3BucketError(Exception):
     """Raised when a specific, named S3 Bucket does not exist"""
@@ -21,3 +23,15 @@ class AwsRegions:
     EU_WEST3 = 'eu-west-3'
     EU_SOUTH1 = 'eu-south-1'
     EU_NORTH1 = 'eu-north-1'
+
+
+def setup_logging(verbose: bool) -> None:
+    """Configure logging for a script: debug messages from the script's
+       own logger are only emitted in verbose mode, while the (very chatty)
+       boto3/botocore loggers are left at the default WARNING level.
+
+    Args:
+        verbose (bool): enable verbose (debug) output
+    """
+    logging.basicConfig(format='%(levelname)s: %(message)s')
+    logging.getLogger('__main__').setLevel(logging.DEBUG if verbose else logging.WARNING)
@@ -1,11 +1,11 @@
 import argparse
-import boto3
+import logging
 import pprint
-import s3_utils
 
-from botocore.exceptions import ClientError
 import commons
 
+# boto3 and s3_utils are imported lazily, see s3_utils
+
 
 # TODO:
 #   - add support for the following CLI arguments using argparse:
@@ -29,12 +29,14 @@ import commons
 #     be automatically created prior to uploading the directory.
 #   - display total elapsed time to create the new S3 bucket
 #   - add detailed logging via the Python standard logging module
-#   - add verbose mode
+#   - [DONE] add verbose mode
 #
 
 
 args = None
 
+log = logging.getLogger(__name__)
+
 
 def create_bucket(bucket_name: str, region: str = None) -> bool:
     """Create a new S3 bucket
@@ -49,12 +51,14 @@ def create_bucket(bucket_name: str, region: str = None) -> bool:
 
     assert (len(bucket_name) > 0)
 
+    import s3_utils
+    from botocore.exceptions import ClientError
+
     global args
 
-    if args.verbose:
-        print(f'DEBUG: create_bucket(): new bucket name={bucket_name}, region={region}')
+    log.debug('create_bucket(): new bucket name=%s, region=%s', bucket_name, region)
 
-    s3_client = boto3.client('s3', region_name=region)
+    s3_client = s3_utils.get_s3_client(region)
 
     try:
         if region and (region != commons.AwsRegions.US_EAST1):
@@ -79,7 +83,9 @@ def create_bucket(bucket_name: str, region: str = None) -> bool:
         print(f"\tError Msg:  {e.response['Error']['Message']}")
         return False
 
-    if args.verbose:
+    # the response is only formatted if debug logging is actually enabled
+    log.debug('create_bucket() response: %r', response)
+    if args.debug_dump:
         print('create_bucket() response:')
         pprint.pprint(response)
         print()
@@ -103,7 +109,8 @@ def create_bucket(bucket_name: str, region: str = None) -> bool:
         print(f"\tError Msg:  {e.response['Error']['Message']}")
         return False
 
-    if args.verbose:
+    log.debug('put_bucket_encryption() response: %r', response)
+    if args.debug_dump:
         print('put_bucket_encryption() response:')
         pprint.pprint(response)
         print()
@@ -112,6 +119,11 @@ def create_bucket(bucket_name: str, region: str = None) -> bool:
 
 
 def main(args: argparse.Namespace) -> None:
+    import boto3
+    import s3_utils
+
+    commons.setup_logging(args.verbose)
+
     if args.verbose:
         print(f'boto3 library version is {boto3.__version__}')
         print(f'Current region is {s3_utils.get_current_region()}')
@@ -174,6 +186,13 @@ if __name__ == "__main__":
         help='location (region) for the new S3 Bucket'
         )
 
+    arg_parser.add_argument(
+        "--debug-dump",
+        required=False,
+        action="store_true",
+        help="pretty-print the full response of every S3 API call"
+        )
+
     args = arg_parser.parse_args()
 
     main(args)
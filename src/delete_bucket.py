@@ -1,52 +1,106 @@
 import argparse
-import boto3
+import logging
 import pprint
 import sys
 
 import commons
-import s3_utils
 
+from concurrent.futures import ThreadPoolExecutor, as_completed
 from timeit import default_timer as timer
-from botocore.exceptions import ClientError
+
+# boto3 and s3_utils are imported lazily, see s3_utils
+
+# default number of threads issuing DeleteObjects requests concurrently
+DEFAULT_CONCURRENCY = 10
+
+# ID of the lifecycle rule used to let S3 expire the bucket contents
+LIFECYCLE_RULE_ID = 'aws-s3-toolkit-expire-all'
+
+log = logging.getLogger(__name__)
 
 PROMPT_MSG_EMPTY_BUCKET  = 'Are you sure you want to proceed with emptying the S3 bucket contents? [Y/N] '
 PROMPT_MSG_DELETE_BUCKET = 'Are you sure you want to proceed with deleting the S3 bucket? [Y/N] '
+PROMPT_MSG_EXPIRE_BUCKET = 'This replaces any existing lifecycle configuration of the S3 bucket. Are you sure you want to proceed with expiring the S3 bucket contents? [Y/N] '
+
+VALID_ANSWERS = frozenset({'y', 'yes', 'n', 'no'})
+YES_ANSWERS = frozenset({'y', 'yes'})
+
+
+def _delete_objects(s3_client, bucket_name: str, keys: list[str]) -> list[dict]:
+    """Delete a batch of (at most 1000) objects from the specified S3
+       bucket with a single DeleteObjects request
+
+    Returns:
+        list[dict]: the errors for the objects that could not be deleted
+    """
+    response = s3_client.delete_objects(
+        Bucket=bucket_name,
+        Delete={
+            'Objects': [{'Key': key} for key in keys],
+            'Quiet': True
+        })
+
+    return response.get('Errors', [])
 
 
-def empty_out_bucket(bucket_name: str, location: str, verbose: bool) -> bool:
+def empty_out_bucket(bucket_name: str, location: str, verbose: bool, concurrency: int = DEFAULT_CONCURRENCY) -> bool:
     """Empty out and delete the contents of the specified S3 bucket
 
     Args:
         bucket_name (str): name of the S3 bucket
         location (str): the location (region) the S3 bucket resides in
         verbose (bool): enable verbose output
+        concurrency (int, optional): number of DeleteObjects requests to
+        issue in parallel. Defaults to DEFAULT_CONCURRENCY.
 
     Returns:
         bool: True if the contents of the specified S3 bucket were
               successfully deleted, False otherwise
     """
+    import s3_utils
+    from botocore.exceptions import ClientError
+
     try:
-        # this approach is taken from the following SO reference:
-        #   https://stackoverflow.com/questions/43326493/what-is-the-fastest-way-to-empty-s3-bucket-using-boto3
+        # Every page returned by ListObjectsV2 holds at most 1000 keys,
+        # which is also the most a single DeleteObjects request accepts,
+        # so each page is deleted as one batch. The batches are deleted
+        # by a pool of threads while the listing carries on.
         #
         # Note that this approach below will not work for S3 buckets
         # that have versioning enabled
         print(f'Emptying out & deleting the contents of S3 bucket {bucket_name} in location {location} ...')
 
         start = timer()
-        s3_resource = boto3.resource('s3', region_name=location)
-        bucket = s3_resource.Bucket(bucket_name)
-        response  = bucket.objects.all().delete()
+        s3_client = s3_utils.get_s3_client(location)
+        paginator = s3_client.get_paginator('list_objects_v2')
+
+        object_count = 0
+        errors = []
+        with ThreadPoolExecutor(max_workers=concurrency) as executor:
+            futures = []
+            for page in paginator.paginate(Bucket=bucket_name):
+                keys = [obj['Key'] for obj in page.get('Contents', ())]
+                if keys:
+                    object_count += len(keys)
+                    futures.append(executor.submit(_delete_objects, s3_client, bucket_name, keys))
+
+            for future in as_completed(futures):
+                errors.extend(future.result())
         end = timer()
 
         elapsed_time = round(end - start, 3)
-        print(f'Emptied out bucket contents in {elapsed_time} seconds')
+        print(f'Deleted {object_count - len(errors)} objects in {elapsed_time} seconds')
 
         if verbose:
-            print('bucket.objects.all().delete() response:')
-            pprint.pprint(response)
+            print(f'{len(futures)} DeleteObjects requests issued')
             print()
 
+        if errors:
+            print(f'ERROR: unable to delete {len(errors)} objects from bucket {bucket_name}:')
+            for error in errors:
+                print(f"\t{error['Key']}: {error['Code']}: {error['Message']}")
+            return False
+
         return True
     except ClientError as e:
         print(f'S3 ClientError occurred while trying to empty out bucket:')
@@ -54,30 +108,88 @@ def empty_out_bucket(bucket_name: str, location: str, verbose: bool) -> bool:
         return False
 
 
-def delete_bucket(bucket_name: str, location: str, verbose: bool) -> bool:
+def expire_bucket_contents(bucket_name: str, location: str, verbose: bool) -> bool:
+    """Add a lifecycle rule to the specified S3 bucket that expires all of
+       its contents, and return without waiting for S3 to act on it.
+
+       For very large buckets this is the cheapest way to empty them out:
+       S3 deletes the objects asynchronously (typically within a day or
+       two) and no DeleteObjects requests are needed at all. Once the
+       bucket is empty, it can then be deleted.
+
+    Args:
+        bucket_name (str): name of the S3 bucket
+        location (str): the location (region) the S3 bucket resides in
+        verbose (bool): enable verbose output
+
+    Returns:
+        bool: True if the lifecycle rule was successfully added, False
+              otherwise
+    """
+    import s3_utils
+    from botocore.exceptions import ClientError
+
+    try:
+        print(f'Adding lifecycle rule to expire the contents of S3 bucket {bucket_name} in location {location} ...')
+
+        s3_client = s3_utils.get_s3_client(location)
+        response = s3_client.put_bucket_lifecycle_configuration(
+            Bucket=bucket_name,
+            LifecycleConfiguration={
+                'Rules': [
+                    {
+                        'ID': LIFECYCLE_RULE_ID,
+                        'Filter': {'Prefix': ''},
+                        'Status': 'Enabled',
+                        'Expiration': {'Days': 1},
+                        'NoncurrentVersionExpiration': {'NoncurrentDays': 1},
+                        'AbortIncompleteMultipartUpload': {'DaysAfterInitiation': 1}
+                    },
+                ]
+            })
+
+        log.debug('put_bucket_lifecycle_configuration() response: %r', response)
+
+        print(f'S3 will now expire the contents of bucket {bucket_name} asynchronously;')
+        print(f'run this script again to delete the bucket once it is empty')
+        return True
+    except ClientError as e:
+        print(f'S3 ClientError occurred while trying to add lifecycle rule:')
+        print(f"\t{e.response['Error']['Code']}: {e.response['Error']['Message']}")
+        return False
+
+
+def delete_bucket(bucket_name: str, location: str, verbose: bool, debug_dump: bool = False) -> bool:
     """Delete the specified S3 bucket
 
     Args:
         bucket_name (str): name of the S3 bucket
         location (str): the location (region) the S3 bucket resides in
         verbose (bool): enable verbose output
+        debug_dump (bool, optional): pretty-print the full API response.
+        Defaults to False.
 
     Returns:
         bool: True if the specified S3 bucket was successfully deleted,
               False otherwise
     """
+    import s3_utils
+    from botocore.exceptions import ClientError
+
     try:
         print(f'Deleting S3 bucket {bucket_name} in location {location} ...')
 
         start = timer()
-        s3_client = boto3.client('s3', region_name=location)
+        s3_client = s3_utils.get_s3_client(location)
         response = s3_client.delete_bucket(Bucket=bucket_name)
         end = timer()
 
         elapsed_time = round(end - start, 3)
         print(f'Deleted bucket in {elapsed_time} seconds')
 
-        if verbose:
+        # the response is only formatted if debug logging is actually enabled
+        log.debug('delete_bucket() response: %r', response)
+        if debug_dump:
             print('delete_bucket() response:')
             pprint.pprint(response)
             print()
@@ -92,46 +204,23 @@ def delete_bucket(bucket_name: str, location: str, verbose: bool) -> bool:
 
 
 def user_confirm(prompt_msg: str = 'Are you sure you want to proceed? [Y/N] ') -> bool:
-    answer = ""
-
-    while answer not in ["y", "yes", "n", "no"]:
-        answer = input(prompt_msg).lower()
-
-    return (answer == "y") or (answer == "yes")
-
-
-if __name__ == "__main__":
-    arg_parser = argparse.ArgumentParser(
-        description='Script to delete an existing S3 Bucket')
+    while (answer := input(prompt_msg).strip().lower()) not in VALID_ANSWERS:
+        pass
 
-    arg_parser.add_argument(
-        "-v",
-        "--verbose",
-        required=False,
-        action="store_true",
-        help="display verbose output"
-        )
+    return answer in YES_ANSWERS
 
-    arg_parser.add_argument(
-        's3_bucket_name',
-        type=str,
-        help='name of the S3 Bucket'
-        )
 
-    arg_parser.add_argument(
-        "-y",
-        "--yes",
-        required=False,
-        action="store_true",
-        help="assume Yes to all confirmation prompts"
-        )
+def main(args: argparse.Namespace) -> None:
+    import boto3
+    import s3_utils
+    from botocore.exceptions import ClientError
 
-    args = arg_parser.parse_args()
+    commons.setup_logging(args.verbose)
 
     if args.verbose:
         print(f'python version: {sys.version}')
         print(f'boto3 library version: {boto3.__version__}')
-        print(f'Current region: {boto3.Session().region_name}')
+        print(f'Current region: {s3_utils.get_current_region()}')
         print()
 
     no_user_prompt = args.yes
@@ -144,24 +233,94 @@ if __name__ == "__main__":
         bucket_location = s3_utils.get_bucket_location(args.s3_bucket_name)
         print(f'bucket {args.s3_bucket_name} resides in {bucket_location}')
 
-        # TODO: revisit this approach to checking if a bucket is empty
-        is_empty = s3_utils.is_bucket_empty(args.s3_bucket_name, bucket_location)
+        # With --yes the bucket is emptied out unconditionally, which is
+        # simply a no-op for a bucket that is already empty, so there is
+        # no need to check for that first.
+        if not no_user_prompt or args.async_lifecycle:
+            is_empty = s3_utils.is_bucket_empty(args.s3_bucket_name, bucket_location)
     except ClientError as e:
         print(f'ERROR: unable to get location (region) for bucket {args.s3_bucket_name}')
         print(f"\t{e.response['Error']['Code']}: {e.response['Error']['Message']}")
         sys.exit(1)
 
+    if args.async_lifecycle and not is_empty:
+        # the bucket can only be deleted after S3 has expired its contents
+        if no_user_prompt:
+            print(f'WARNING: proceeding with expiring the contents of S3 bucket {args.s3_bucket_name} without prompt/confirmation ...')
+            expire_bucket_contents(args.s3_bucket_name, bucket_location, args.verbose)
+        elif user_confirm(PROMPT_MSG_EXPIRE_BUCKET):
+            expire_bucket_contents(args.s3_bucket_name, bucket_location, args.verbose)
+        return
+
     if no_user_prompt:
         if not is_empty:
             print(f'WARNING: proceeding with emptying out S3 bucket {args.s3_bucket_name} without prompt/confirmation ...')
-            empty_out_bucket(args.s3_bucket_name, bucket_location, args.verbose)
+            empty_out_bucket(args.s3_bucket_name, bucket_location, args.verbose, args.concurrency)
             print()
 
         print(f'WARNING: proceeding with deleting S3 bucket {args.s3_bucket_name} without prompt/confirmation ...')
-        delete_bucket(args.s3_bucket_name, bucket_location, args.verbose)
+        delete_bucket(args.s3_bucket_name, bucket_location, args.verbose, args.debug_dump)
         print()
     else:
         if not is_empty and user_confirm(PROMPT_MSG_EMPTY_BUCKET):
-            empty_out_bucket(args.s3_bucket_name, bucket_location, args.verbose)
+            empty_out_bucket(args.s3_bucket_name, bucket_location, args.verbose, args.concurrency)
         if user_confirm(PROMPT_MSG_DELETE_BUCKET):
-            delete_bucket(args.s3_bucket_name, bucket_location, args.verbose)
+            delete_bucket(args.s3_bucket_name, bucket_location, args.verbose, args.debug_dump)
+
+
+if __name__ == "__main__":
+    arg_parser = argparse.ArgumentParser(
+        description='Script to delete an existing S3 Bucket')
+
+    arg_parser.add_argument(
+        "-v",
+        "--verbose",
+        required=False,
+        action="store_true",
+        help="display verbose output"
+        )
+
+    arg_parser.add_argument(
+        's3_bucket_name',
+        type=str,
+        help='name of the S3 Bucket'
+        )
+
+    arg_parser.add_argument(
+        "-y",
+        "--yes",
+        required=False,
+        action="store_true",
+        help="assume Yes to all confirmation prompts"
+        )
+
+    arg_parser.add_argument(
+        "--debug-dump",
+        required=False,
+        action="store_true",
+        help="pretty-print the full response of every S3 API call"
+        )
+
+    arg_parser.add_argument(
+        '--concurrency',
+        action='store',
+        metavar='N',
+        required=False,
+        type=int,
+        default=DEFAULT_CONCURRENCY,
+        help=f'number of batch delete requests to issue in parallel (default: {DEFAULT_CONCURRENCY})'
+        )
+
+    arg_parser.add_argument(
+        "--async-lifecycle",
+        required=False,
+        action="store_true",
+        help="let S3 expire the bucket contents via a lifecycle rule, and return immediately"
+        )
+
+    args = arg_parser.parse_args()
+
+    if args.concurrency < 1:
+        arg_parser.error('--concurrency must be a positive integer')
+
+    main(args)
@@ -1,23 +1,27 @@
 import argparse
-import boto3
 import os
+import queue
+import shutil
 import sys
 
 import hash_utils
-import s3_utils
 
+from collections import Counter
+from concurrent.futures import Future, ThreadPoolExecutor
 from datetime import timedelta
 from timeit import default_timer as timer
-from tqdm import tqdm
+from typing import Optional
 from commons import NonExistentS3BucketError
 
+# boto3, s3_utils and tqdm are imported lazily, see s3_utils
+
 
 # TODO
-#   - fix the issue when the current region (in config) is not the same
+#   - [DONE] fix the issue when the current region (in config) is not the same
 #     as the region in which the S3 Bucket is located.
 #   - integrate the Python std logging module, and log all output to
 #     an ondisk logfile
-#   - modify this script such that the integrity hash files are an internal
+#   - [DONE] modify this script such that the integrity hash files are an internal
 #     implementation detail and nothing about them is visible except for when
 #     file integrity verification fails
 #   - add a verbose mode
@@ -29,52 +33,314 @@ from commons import NonExistentS3BucketError
 #     bucket into a local dir with the same name as the S3 bucket
 #   - if a --dir <download dir/path> option is specified, then the contents
 #     of the S3 bucket should be downloaded into that specified dir/path
+#   - [DONE] download files concurrently using a pool of worker threads
 #
 
 
+DEFAULT_CONCURRENCY = 16
+
+# Files larger than the multipart threshold are downloaded as concurrent
+# byte-range GETs of MULTIPART_CHUNKSIZE bytes each, instead of over a
+# single stream.
+MULTIPART_THRESHOLD = 16 * 1024 * 1024
+MULTIPART_CHUNKSIZE = 16 * 1024 * 1024
+MAX_PART_CONCURRENCY = 10
+
+# maximum number of files queued up for download at any one time; together
+# with the bounded listing (see s3_utils.iter_bucket_contents()), this keeps
+# memory use bounded, however many files the bucket holds
+MAX_QUEUED_DOWNLOADS = 1024
+
+
 class S3FileDownloader:
     """A utility class to download files from an S3 Bucket"""
 
-    def __init__(self, bucket_name: str) -> None:
+    def __init__(self, bucket_name: str, concurrency: int = DEFAULT_CONCURRENCY) -> None:
+        import s3_utils
+        from boto3.s3.transfer import TransferConfig
+
+        # Upper bound on the total number of in-flight GET requests
+        # (concurrent files x concurrent parts per file). All of them share
+        # the connection pool of a single S3 client, and this also keeps
+        # well below the S3 request rate limit of 5500 GETs/sec per prefix.
+        max_inflight_requests = s3_utils.MAX_POOL_CONNECTIONS
+
         self.bucket_name = bucket_name
-        self.s3_resource = None
-        self.hash_files = []
+        self.concurrency = concurrency
+        self.transfer_config = TransferConfig(
+            multipart_threshold=MULTIPART_THRESHOLD,
+            multipart_chunksize=MULTIPART_CHUNKSIZE,
+            max_concurrency=max(1, min(MAX_PART_CONCURRENCY, max_inflight_requests // concurrency)),
+            use_threads=True
+            )
+        self.location = None
+        self.s3_client = None
+
+        # integrity hash file key -> (path of the downloaded file it
+        # belongs to, expected hash, hash algorithm); None for a malformed
+        # hash file
+        self.expected_hashes = {}
+
+        # key -> path of every downloaded data file
+        self.downloaded_files = {}
+
+        # key -> (path of the downloaded file, expected hash, hash
+        # algorithm) of every downloaded data file with a hash in its
+        # object metadata (or in its manifest)
+        self.metadata_hashes = {}
 
 
     def initialize(self) -> None:
-        resource = boto3.resource('s3')
+        import s3_utils
 
-        if not s3_utils.check_bucket(resource, self.bucket_name):
+        # one HeadBucket request both checks that the bucket exists and
+        # resolves its location (region)
+        location = s3_utils.get_bucket_region(self.bucket_name)
+        if not location:
             raise NonExistentS3BucketError(self.bucket_name)
 
-        self.s3_resource = resource
+        self.location = location
+
+        # S3 clients are thread-safe, so all of the worker threads share
+        # this one client (and its pool of kept-alive connections). The
+        # client talks to the bucket's own region directly, so that S3
+        # never has to redirect any requests.
+        self.s3_client = s3_utils.get_s3_client(location)
+
+
+    @staticmethod
+    def _local_path(dir_path: str, file: str) -> Optional[str]:
+        """Get the local path a key (or a file named in a hash file or a
+           manifest) is downloaded to
+
+        Args:
+            dir_path (str): the directory the bucket is downloaded into
+            file (str): the key, relative to dir_path
+
+        Returns:
+            str: the local path; None if that isn't within dir_path (e.g.
+                 for keys such as '../a.txt' or '/etc/passwd')
+        """
+        full_file_path = os.path.normpath(os.path.join(dir_path, file))
+
+        root = os.path.abspath(dir_path)
+        abs_file_path = os.path.abspath(full_file_path)
+        if abs_file_path == root or os.path.commonpath([root, abs_file_path]) != root:
+            return None
+
+        return full_file_path
+
+
+    def _download_one(self, file: str, full_file_path: str, dir_path: str) -> list[tuple[str, str, Optional[tuple[str, str, str]]]]:
+        """Download a data file, or restore the files listed in a manifest
+           (internal helper)
+
+        Returns:
+            list: the key, path and expected hash (if known) of every file
+                  downloaded; empty for a chunk
+        """
+
+        # Files uploaded without a separate integrity hash file carry their
+        # hash in their object metadata instead. It is looked up right here
+        # in the worker, so that the HeadObject request overlaps with the
+        # other downloads. The download itself is left to s3transfer, which
+        # retries a broken stream and only puts the file in place once it
+        # is complete.
+        response = self.s3_client.head_object(Bucket=self.bucket_name, Key=file)
+        metadata = response['Metadata']
+
+        dedup = metadata.get(hash_utils.DEDUP_METADATA_KEY)
+        if dedup == hash_utils.DEDUP_CHUNK:
+            # chunks are only downloaded as part of restoring the files
+            # listed in a manifest
+            return []
+        if dedup == hash_utils.DEDUP_MANIFEST:
+            restored_files = self._restore_manifest_files(file, dir_path)
+            if restored_files is not None:
+                return restored_files
+
+        # (the directories for keys under the chunk prefix are only created
+        # once they turn out not to be chunks)
+        if file.startswith(hash_utils.CHUNK_KEY_PREFIX):
+            os.makedirs(os.path.dirname(full_file_path), exist_ok=True)
+
+        self.s3_client.download_file(self.bucket_name, file, full_file_path, Config=self.transfer_config)
+
+        return [(file, full_file_path, self._metadata_hash(metadata, full_file_path))]
+
+
+    def _fetch_expected_hash(self, hash_file: str, dir_path: str) -> Optional[tuple[str, str, str]]:
+        # Integrity hash files are tiny, so instead of downloading them to
+        # disk (only to read them back and delete them again) their
+        # contents are read straight into memory.
+        response = self.s3_client.get_object(Bucket=self.bucket_name, Key=hash_file)
+        parts = hash_utils.parse_integrity_hash(response['Body'].read().decode())
+        if not parts:
+            return None
+
+        # the hash file refers to its data file relative to its own location
+        filename, expected_hash = parts
+        full_file_path = self._local_path(dir_path, os.path.join(os.path.dirname(hash_file), filename))
+        if not full_file_path:
+            return None
+
+        return full_file_path, expected_hash, hash_utils.HASHFILE_HASH_ALGORITHM
+
+
+    @staticmethod
+    def _metadata_hash(metadata: dict, full_file_path: str) -> Optional[tuple[str, str, str]]:
+        # the hash in the object (user) metadata is keyed by the name of the
+        # hash algorithm it was computed with
+        algorithms = [algorithm for algorithm in hash_utils.METADATA_HASH_ALGORITHMS if algorithm in metadata]
+        if not algorithms:
+            return None
+
+        # an algorithm that is available here is preferred; but a hash that
+        # can't be checked is still returned, so that the file is reported
+        # as unverified rather than silently left out
+        algorithms.sort(key=lambda algorithm: not hash_utils.is_hash_algorithm_available(algorithm))
+        return full_file_path, metadata[algorithms[0]], algorithms[0]
+
+
+    def _restore_manifest_files(self, manifest_file: str, dir_path: str) -> Optional[list[tuple[str, str, tuple[str, str, str]]]]:
+        # The files listed in a manifest (uploaded with --dedup) are not
+        # stored as objects of their own, but are reassembled from their
+        # chunks, next to where the manifest itself would have been.
+        response = self.s3_client.get_object(Bucket=self.bucket_name, Key=manifest_file)
+        files = hash_utils.parse_manifest(response['Body'].read().decode())
+        if files is None:
+            return None
+
+        manifest_dir = os.path.dirname(manifest_file)
+
+        # (a manifest only ever lists plain file names)
+        local_files = {}
+        for filename in files:
+            file = os.path.join(manifest_dir, os.path.basename(filename))
+            local_files[filename] = (file, self._local_path(dir_path, file))
+            if not local_files[filename][1]:
+                return None
+
+        restored_files = []
+        for filename, entry in files.items():
+            file, full_file_path = local_files[filename]
+            with open(full_file_path, 'wb') as f:
+                for chunk_key in entry['chunks']:
+                    response = self.s3_client.get_object(Bucket=self.bucket_name, Key=chunk_key)
+                    shutil.copyfileobj(response['Body'], f)
+
+            restored_files.append((file, full_file_path, (full_file_path, entry['hash'], entry['algorithm'])))
+
+        return restored_files
+
+
+    def _collect_result(self, future: Future, file: str, progress_bar) -> int:
+        """Collect the result of a download (or hash file fetch) that has
+           completed; this is only ever called from the main thread.
+
+        Returns:
+            int: the number of data files downloaded
+        """
+        progress_bar.update()
+
+        if file.endswith('.hash'):
+            self.expected_hashes[file] = future.result()
+            if not self.expected_hashes[file]:
+                progress_bar.write(f'ERROR: unable to parse malformed integrity hash file {file}')
+            return 0
+
+        downloaded_files = future.result()
+        for file, full_file_path, metadata_hash in downloaded_files:
+            self.downloaded_files[file] = full_file_path
+            if metadata_hash:
+                self.metadata_hashes[file] = metadata_hash
+            progress_bar.write(full_file_path)
+        return len(downloaded_files)
 
 
     def _download_all_files(self, dir_path: str) -> int:
-        files_downloaded = 0
+        import s3_utils
+        from tqdm import tqdm
 
-        location = s3_utils.get_bucket_location(self.bucket_name)
+        files_downloaded = 0
 
-        # TODO
-        # the ListObjects() API call requires the location-constraint for the
+        # The ListObjects() API call requires the location-constraint for the
         # S3 Bucket to be specified. For example:
         #   current region is us-east-1
         #   bucket whose contents are to be listed is in another region (me-south-1)
         #
-        # Solution is to specify the exact same region in the call to ListObjects()
-        # as where the S3 Bucket actually resides
-        bucket_files = s3_utils.get_bucket_contents(self.bucket_name, location)
+        # Hence the contents are listed in the exact same region as where the
+        # S3 bucket actually resides (as resolved by initialize()).
+        #
+        # The bucket contents are listed concurrently, and every file is
+        # submitted for download as soon as its key has been listed; the
+        # first downloads don't have to wait for the whole listing.
+        bucket_files = s3_utils.iter_bucket_contents(self.bucket_name, self.location)
 
         os.mkdir(dir_path)
 
-        for file in (progress_bar := tqdm(bucket_files, desc='Downloading files')):
-            full_file_path = os.path.join(dir_path, file)
-            self.s3_resource.Bucket(self.bucket_name).download_file(file, full_file_path)
-            files_downloaded += 1
-            progress_bar.write(full_file_path)
-            split_tup = os.path.splitext(full_file_path)
-            if split_tup[1] == '.hash':
-                self.hash_files.append(full_file_path)
+        # S3 keys can contain a prefix hierarchy (e.g. 'photos/2023/a.jpg').
+        # Each distinct local directory is created exactly once, before the
+        # first file in it is submitted, so that the downloads themselves
+        # don't have to check for it.
+        created_dirs = {os.path.normpath(dir_path)}
+
+        # Completed futures are handed back to the main thread through this
+        # queue, so neither the progress bar nor the expected hashes need
+        # any locking.
+        completed = queue.SimpleQueue()
+        pending = 0
+
+        with ThreadPoolExecutor(max_workers=self.concurrency) as executor, \
+             tqdm(total=0, desc='Downloading files') as progress_bar:
+            try:
+                for file in bucket_files:
+                    # S3 keys are arbitrary strings; one that would be downloaded
+                    # to somewhere outside of the download directory is skipped
+                    full_file_path = self._local_path(dir_path, file)
+                    if not full_file_path:
+                        progress_bar.write(f'WARNING: skipping {file}, which is outside of the download directory')
+                        continue
+
+                    # keys ending in '/' are just "folder" placeholders, there is
+                    # nothing to download for them other than the directory itself
+                    #
+                    # (chunks uploaded with --dedup are only downloaded as part of
+                    # restoring the files listed in a manifest, so there's no
+                    # directory to create for them)
+                    subdir = full_file_path if file.endswith('/') else os.path.dirname(full_file_path)
+                    if subdir not in created_dirs and not file.startswith(hash_utils.CHUNK_KEY_PREFIX):
+                        os.makedirs(subdir, exist_ok=True)
+                        created_dirs.add(subdir)
+
+                    if file.endswith('/'):
+                        continue
+
+                    if file.endswith('.hash'):
+                        future = executor.submit(self._fetch_expected_hash, file, dir_path)
+                    else:
+                        future = executor.submit(self._download_one, file, full_file_path, dir_path)
+                    future.add_done_callback(lambda future, file=file: completed.put((future, file)))
+                    pending += 1
+                    progress_bar.total += 1
+
+                    # collect whatever has completed while listing carries on;
+                    # and once too many files are queued up, wait for downloads
+                    # to complete before submitting any more
+                    while pending >= MAX_QUEUED_DOWNLOADS or not completed.empty():
+                        files_downloaded += self._collect_result(*completed.get(), progress_bar)
+                        pending -= 1
+
+                while pending:
+                    files_downloaded += self._collect_result(*completed.get(), progress_bar)
+                    pending -= 1
+            except BaseException:
+                # stop listing, and don't wait for all of the queued downloads
+                # to complete before the error is reported (only for those
+                # that are already in progress)
+                bucket_files.close()
+                executor.shutdown(cancel_futures=True)
+                raise
 
         return files_downloaded
 
@@ -93,21 +359,57 @@ class S3FileDownloader:
         return self._download_all_files(target_dir)
 
 
+    @staticmethod
+    def _verify_hash(full_file_path: str, expected_hash: str, algorithm: str) -> bool:
+        try:
+            return hash_utils.verify_hash(full_file_path, expected_hash, algorithm)
+        except OSError:
+            # e.g. the file named in the hash file doesn't exist
+            return False
+
+
     def verify_hashes(self) -> bool:
-        verified_count = 0
-        failed_count = 0
+        from tqdm import tqdm
 
-        for hash_filename in tqdm(self.hash_files, desc='Verifying integrity hashes'):
-            if hash_utils.verify_integrity_hash_file(hash_filename):
-                os.remove(hash_filename)
-                verified_count += 1
-            else:
-                failed_count += 1
+        expected_hashes = [parts for parts in self.expected_hashes.values() if parts]
 
-        return verified_count == len(self.hash_files)
+        verified_count = 0
+        failed_count = len(self.expected_hashes) - len(expected_hashes)
+
+        # the data files without an integrity hash file are verified against
+        # the hash in their object metadata (if present at all)
+        expected_hashes.extend(parts for file, parts in self.metadata_hashes.items()
+                               if file + '.hash' not in self.expected_hashes)
+
+        # files hashed with an algorithm that isn't available here can't be
+        # verified at all, and count as unverified
+        unavailable = Counter(algorithm for _, _, algorithm in expected_hashes
+                              if not hash_utils.is_hash_algorithm_available(algorithm))
+        for algorithm, count in unavailable.items():
+            package = hash_utils.HASH_ALGORITHM_PACKAGES.get(algorithm)
+            hint = f' (pip install {package})' if package else ''
+            print(f'WARNING: unable to verify {count} files hashed with {algorithm}, which is not available{hint}')
+        failed_count += sum(unavailable.values())
+        expected_hashes = [parts for parts in expected_hashes if parts[2] not in unavailable]
+
+        # hashing releases the GIL, so the files can be verified in
+        # parallel by a pool of threads
+        with ThreadPoolExecutor(max_workers=os.cpu_count()) as executor:
+            results = executor.map(lambda parts: self._verify_hash(*parts), expected_hashes)
+            for (full_file_path, *_), verified in (progress_bar := tqdm(zip(expected_hashes, results), total=len(expected_hashes), desc='Verifying integrity hashes')):
+                if verified:
+                    verified_count += 1
+                else:
+                    failed_count += 1
+                    progress_bar.write(f'ERROR: integrity hash verification failed for {full_file_path}')
+
+        return failed_count == 0
 
 
 def main(args: argparse.Namespace) -> None:
+    import boto3
+    import s3_utils
+
     if args.verbose:
         print(f'boto3 library version is {boto3.__version__}')
         print(f'Current region is {s3_utils.get_current_region()}')
@@ -115,7 +417,7 @@ def main(args: argparse.Namespace) -> None:
 
     print(f'Downloading all files from S3 bucket: {args.s3_bucket_name}')
 
-    file_downloader = S3FileDownloader(args.s3_bucket_name)
+    file_downloader = S3FileDownloader(args.s3_bucket_name, args.concurrency)
     try:
         file_downloader.initialize()
     except NonExistentS3BucketError as e:
@@ -166,6 +468,19 @@ if __name__ == "__main__":
         help='directory within which to download the file or S3 Bucket'
         )
 
+    arg_parser.add_argument(
+        '--concurrency',
+        action='store',
+        metavar='N',
+        required=False,
+        type=int,
+        default=DEFAULT_CONCURRENCY,
+        help=f'number of files to download in parallel (default: {DEFAULT_CONCURRENCY})'
+        )
+
     args = arg_parser.parse_args()
 
+    if args.concurrency < 1:
+        arg_parser.error('--concurrency must be a positive integer')
+
     main(args)
@@ -1,5 +1,10 @@
 import hashlib
+import json
+import mmap
 import os
+import random
+
+from typing import Iterator, Optional, Union
 
 
 # TODO:
@@ -10,23 +15,117 @@ import os
 
 HASHFILE_PART_SEP = ":"
 
+# the hash algorithm used for (and implied by) integrity hash files
+HASHFILE_HASH_ALGORITHM = "blake2b"
+
+
+# BLAKE3 is much faster than BLAKE2b: it is SIMD-parallel, and hashes large
+# inputs on multiple threads. It is an optional dependency though
+# (pip install blake3), and BLAKE2b is used instead when it isn't installed.
+try:
+    from blake3 import blake3
+except ImportError:
+    blake3 = None
+
+HASH_ALGORITHM = "blake3" if blake3 else HASHFILE_HASH_ALGORITHM
+
+# the hash algorithms an integrity hash may be stored under in the
+# metadata of an S3 object, in order of preference
+METADATA_HASH_ALGORITHMS = ("blake3", "blake2b")
+
+# the packages that provide the optional hash algorithms
+HASH_ALGORITHM_PACKAGES = {"blake3": "blake3"}
+
+# size of the blocks a file is read in when computing its hash
+HASH_BLOCK_SIZE = 1024 * 1024
+
+# Content-defined chunking (see cdc_chunks()): the minimum, average and
+# maximum size of a chunk
+CDC_MIN_SIZE = 1 * 1024 * 1024
+CDC_AVG_SIZE = 4 * 1024 * 1024
+CDC_MAX_SIZE = 16 * 1024 * 1024
+
+# The Gear hash table: a random 64-bit integer for every possible byte
+# value. It is generated from a fixed seed, because chunk boundaries (and
+# therefore deduplication) must be the same on every run and machine.
+_gear_rng = random.Random(0x5EED)
+_GEAR = tuple(_gear_rng.getrandbits(64) for _ in range(256))
+del _gear_rng
+_GEAR_BITS = 64
+_GEAR_MASK = (1 << _GEAR_BITS) - 1
+
+# deduplicated chunks are stored under this key prefix, keyed by their hash
+CHUNK_KEY_PREFIX = ".chunks/"
+
+# The hash algorithm chunk keys are derived from. Unlike HASH_ALGORITHM, it
+# doesn't depend on whether blake3 happens to be installed: the same chunk
+# must always get the same key, or it won't be found by later uploads.
+CHUNK_HASH_ALGORITHM = "blake2b"
+
+# the key suffix of chunk manifests
+MANIFEST_SUFFIX = ".manifest.json"
+
+# The (user) metadata key that marks the objects uploaded with --dedup,
+# with either of the values below. Only objects carrying it are treated as
+# manifests or chunks when downloading; whatever their key, all other
+# objects are just regular files.
+DEDUP_METADATA_KEY = "aws-s3-toolkit-dedup"
+DEDUP_MANIFEST = "manifest"
+DEDUP_CHUNK = "chunk"
+
 
-def get_hash(filepath: str) -> str:
-    with open(filepath, "rb") as f:
-        hash_algo = hashlib.blake2b()
-        while chunk := f.read(8192):
-            hash_algo.update(chunk)
+def is_hash_algorithm_available(algorithm: str) -> bool:
+    if algorithm == "blake3":
+        return blake3 is not None
+
+    return algorithm in hashlib.algorithms_available
+
+
+def _new_hash(algorithm: str):
+    if algorithm == "blake3" and blake3:
+        return blake3(max_threads=blake3.AUTO)
+
+    return hashlib.new(algorithm)
+
+
+def get_hash(filepath: str, algorithm: str = HASH_ALGORITHM) -> str:
+    # The file is read into a single, reused buffer; so memory use stays at
+    # one block regardless of the size of the file, and no new bytes object
+    # is allocated per block. (update() releases the GIL for large blocks
+    # like these, so other threads keep running while a file is hashed.)
+    hash_algo = _new_hash(algorithm)
+    buffer = bytearray(HASH_BLOCK_SIZE)
+    view = memoryview(buffer)
+    with open(filepath, "rb", buffering=0) as f:
+        while size := f.readinto(buffer):
+            hash_algo.update(view[:size])
 
     file_hash = hash_algo.hexdigest()
     return file_hash
 
 
+def get_buffer_hash(buffer: Union[bytes, mmap.mmap], algorithm: str = HASH_ALGORITHM) -> str:
+    """Compute the integrity hash of data that is already in memory (or
+       memory-mapped), without copying it
+
+    Args:
+        buffer (bytes | mmap): the data (any bytes-like object)
+        algorithm (str): the hash algorithm to use
+
+    Returns:
+        str: the integrity hash of the data in hexadecimal
+    """
+    hash_algo = _new_hash(algorithm)
+    hash_algo.update(buffer)
+    return hash_algo.hexdigest()
+
+
 def create_integrity_hash_file(filepath: str) -> str:
     real_path = os.path.realpath(filepath)
     filename = os.path.basename(real_path)
 
     # the integrity hash of the specified file in hexadecimal
-    file_hash = get_hash(real_path)
+    file_hash = get_hash(real_path, HASHFILE_HASH_ALGORITHM)
 
     hash_filepath = real_path + ".hash"
 
@@ -35,17 +134,35 @@ def create_integrity_hash_file(filepath: str) -> str:
             f.write(f'{filename}{HASHFILE_PART_SEP}{file_hash}')
 
         return hash_filepath
-    except:
+    except OSError:
         print(f'ERROR: unable to write integrity hash to file {hash_filepath}')
         return ""
 
 
+def parse_integrity_hash(contents: str) -> Optional[tuple[str, str]]:
+    """Parse the contents of an integrity hash file
+
+    Args:
+        contents (str): the contents of the integrity hash file
+
+    Returns:
+        tuple[str, str]: the name of the file the hash belongs to, and the
+                         hash itself; None if the contents are malformed
+    """
+    line = contents.split("\n", 1)[0]
+    parts = line.split(HASHFILE_PART_SEP)
+
+    if len(parts) != 2:
+        return None
+
+    return parts[0], parts[1]
+
+
 def verify_integrity_hash_file(hash_filepath: str) -> bool:
     with open(hash_filepath, "r") as f:
-        line = f.readline()
-        parts = line.split(HASHFILE_PART_SEP)
+        parts = parse_integrity_hash(f.readline())
 
-        if len(parts) != 2:
+        if not parts:
             print(f'ERROR: unable to parse malformed integrity hash file {hash_filepath}')
             return False
 
@@ -53,10 +170,115 @@ def verify_integrity_hash_file(hash_filepath: str) -> bool:
 
         hash_value = parts[1]
 
-        return verify_hash(filepath, hash_value)
+        return verify_hash(filepath, hash_value, HASHFILE_HASH_ALGORITHM)
 
 
-def verify_hash(filepath: str, expected_hash: str) -> bool:
-    computed_hash = get_hash(filepath)
+def verify_hash(filepath: str, expected_hash: str, algorithm: str = HASH_ALGORITHM) -> bool:
+    computed_hash = get_hash(filepath, algorithm)
 
     return computed_hash == expected_hash
+
+
+def _cdc_mask(bits: int) -> int:
+    # the topmost bits of the Gear hash depend on the most recent bytes
+    return ((1 << bits) - 1) << (_GEAR_BITS - bits)
+
+
+def _cdc_cut_point(buffer: Union[bytes, mmap.mmap], start: int, end: int, min_size: int, avg_size: int,
+                   mask_small: int, mask_large: int) -> int:
+    if end - start <= min_size:
+        return end
+
+    gear = _GEAR
+    gear_mask = _GEAR_MASK
+
+    # Every byte is shifted out of the hash again after 64 bytes; so there
+    # is no need to hash anything before the 64 bytes leading up to the
+    # minimum chunk size.
+    min_end = start + min_size
+    hash_value = 0
+    for byte in buffer[max(start, min_end - _GEAR_BITS):min_end]:
+        hash_value = ((hash_value << 1) + gear[byte]) & gear_mask
+
+    # normalized chunking: a cut point is harder to find (more mask bits)
+    # before the average chunk size than after it
+    position = min_end
+    avg_end = min(start + avg_size, end)
+    for byte in buffer[min_end:avg_end]:
+        hash_value = ((hash_value << 1) + gear[byte]) & gear_mask
+        position += 1
+        if not hash_value & mask_small:
+            return position
+
+    for byte in buffer[avg_end:end]:
+        hash_value = ((hash_value << 1) + gear[byte]) & gear_mask
+        position += 1
+        if not hash_value & mask_large:
+            return position
+
+    return end
+
+
+def cdc_chunks(buffer: Union[bytes, mmap.mmap], min_size: int = CDC_MIN_SIZE, avg_size: int = CDC_AVG_SIZE,
+               max_size: int = CDC_MAX_SIZE) -> Iterator[tuple[int, int]]:
+    """Split data into content-defined chunks (FastCDC, using a Gear hash)
+
+    The chunk boundaries are determined by the contents of the data itself,
+    rather than by fixed offsets. So when some data is inserted into (or
+    removed from) a file, only the chunks around that change are affected,
+    and all of the other chunks stay the same.
+
+    Args:
+        buffer (bytes | mmap): the data (any bytes-like object)
+        min_size (int): minimum size of a chunk in bytes
+        avg_size (int): average size of a chunk in bytes (a power of 2)
+        max_size (int): maximum size of a chunk in bytes
+
+    Yields:
+        tuple[int, int]: the start and end offset of each chunk
+    """
+    bits = avg_size.bit_length() - 1
+    mask_small = _cdc_mask(bits + 2)
+    mask_large = _cdc_mask(bits - 2)
+
+    length = len(buffer)
+    start = 0
+    while start < length:
+        end = _cdc_cut_point(buffer, start, min(start + max_size, length), min_size, avg_size, mask_small, mask_large)
+        yield start, end
+        start = end
+
+
+def create_manifest(files: dict) -> str:
+    """Create a chunk manifest
+
+    Args:
+        files (dict): file name -> {'size': size in bytes, 'algorithm': hash
+                      algorithm, 'hash': integrity hash of the whole file,
+                      'chunks': keys of its chunks, in order}
+
+    Returns:
+        str: the contents of the manifest
+    """
+    return json.dumps({"version": 1, "files": files}, indent=1)
+
+
+def parse_manifest(contents: str) -> Optional[dict]:
+    """Parse the contents of a chunk manifest
+
+    Args:
+        contents (str): the contents of the manifest
+
+    Returns:
+        dict: file name -> its entry (see create_manifest()); None if the
+              contents are malformed
+    """
+    try:
+        manifest = json.loads(contents)
+    except ValueError:
+        return None
+
+    if not isinstance(manifest, dict) or manifest.get("version") != 1 or not isinstance(manifest.get("files"), dict):
+        return None
+
+    return manifest["files"]
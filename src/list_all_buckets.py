@@ -1,11 +1,11 @@
 import argparse
-import boto3
 import sys
-import s3_utils
 
+from concurrent.futures import ThreadPoolExecutor
 from pprint import pprint
 from timeit import default_timer as timer
-from botocore.exceptions import NoCredentialsError
+
+# boto3 and s3_utils are imported lazily, see s3_utils
 
 
 # TODO:
@@ -15,15 +15,19 @@ from botocore.exceptions import NoCredentialsError
 #   - display the output in a proper, tabular manner with a header
 #
 
+# number of threads used to look up bucket locations (regions) concurrently
+MAX_LOOKUP_WORKERS = 32
+
 
 def list_all_s3_buckets(verbose: bool) -> None:
     """List all S3 buckets associated with the current AWS credentials
        and Region, and print to stdout.
     """
+    import s3_utils
 
     # Retrieve the list of existing buckets
     start = timer()
-    s3_client = boto3.client('s3')
+    s3_client = s3_utils.get_s3_client()
     response = s3_client.list_buckets()
     end = timer()
     elapsed_time = round(end - start, 3)
@@ -35,14 +39,16 @@ def list_all_s3_buckets(verbose: bool) -> None:
         pprint(response)
         print()
 
-    # TODO:
-    #   make a separate call to build up a dict of bucket name -> region/location
+    # Look up the location (region) of every bucket concurrently; each
+    # lookup is a separate round-trip to S3
+    buckets = response['Buckets']
+    with ThreadPoolExecutor(max_workers=MAX_LOOKUP_WORKERS) as executor:
+        bucket_regions = list(executor.map(s3_utils.get_bucket_location, [bucket['Name'] for bucket in buckets]))
 
     # Output the bucket names
-    print(f"Retrieved {len(response['Buckets'])} buckets for current AWS user/account:")
-    for index, bucket in enumerate(response['Buckets'], start=1):
+    print(f"Retrieved {len(buckets)} buckets for current AWS user/account:")
+    for index, (bucket, bucket_region) in enumerate(zip(buckets, bucket_regions), start=1):
         bucket_name = bucket['Name']
-        bucket_region = s3_utils.get_bucket_location(bucket_name)
         if verbose:
             print(f'    {index}. {bucket_name} in region {bucket_region} created on {bucket["CreationDate"]}')
         else:
@@ -51,6 +57,23 @@ def list_all_s3_buckets(verbose: bool) -> None:
     print()
 
 
+def main(args: argparse.Namespace) -> None:
+    import boto3
+    import s3_utils
+    from botocore.exceptions import NoCredentialsError
+
+    if args.verbose:
+        print(f'python version: {sys.version}')
+        print(f'boto3 library version: {boto3.__version__}')
+        print(f'Current region: {s3_utils.get_current_region()}')
+        print()
+
+    try:
+        list_all_s3_buckets(args.verbose)
+    except NoCredentialsError as e:
+        print(f'ERROR: Unable to locate AWS credentials or credentials have been setup incorrectly', file=sys.stderr)
+
+
 if __name__ == "__main__":
     arg_parser = argparse.ArgumentParser(
         description='Script to list all S3 Buckets')
@@ -63,13 +86,4 @@ if __name__ == "__main__":
 
     args = arg_parser.parse_args()
 
-    if args.verbose:
-        print(f'python version: {sys.version}')
-        print(f'boto3 library version: {boto3.__version__}')
-        print(f'Current region: {boto3.Session().region_name}')
-        print()
-
-    try:
-        list_all_s3_buckets(args.verbose)
-    except NoCredentialsError as e:
-        print(f'ERROR: Unable to locate AWS credentials or credentials have been setup incorrectly', file=sys.stderr)
+    main(args)
@@ -1,6 +1,6 @@
-import boto3
 import sys
-import s3_utils
+
+# s3_utils is imported lazily, see s3_utils
 
 
 # TODO:
@@ -16,6 +16,8 @@ import s3_utils
 
 
 def main(bucket_name: str) -> None:
+    import s3_utils
+
     bucket_location = s3_utils.get_bucket_location(bucket_name)
 
     bucket_contents = s3_utils.get_bucket_contents(bucket_name, bucket_location)
@@ -1,12 +1,94 @@
+# Loading boto3 (which this module imports) is by far the slowest part of
+# starting up a script, so the scripts only import this module (and boto3)
+# inside the functions that use it; --help and usage errors then don't have
+# to pay for it.
+import functools
+import queue
+import threading
 import uuid
 import boto3
 import botocore
-from boto3.resources.base import ServiceResource
+from botocore.client import BaseClient
+from botocore.config import Config
+from concurrent.futures import ThreadPoolExecutor
+from typing import Iterator, Optional
 
 
 
 DEFAULT_S3_BUCKET_PREFIX = 'ssahmed'
 
+# Size of the HTTPS connection pool of each S3 client. This should be at
+# least as large as the number of requests a script keeps in flight at
+# any one time, otherwise connections are discarded and re-established.
+MAX_POOL_CONNECTIONS = 64
+
+# Shared configuration for every S3 client created by this
+# toolkit. TCP keep-alive keeps idle pooled connections open so that
+# subsequent calls don't pay for a new TCP + TLS handshake.
+#
+# The 'adaptive' retry mode retries throttled (SlowDown / 503) requests
+# with exponential backoff and jitter, and additionally rate-limits the
+# client itself once S3 starts throttling it, which matters when many
+# threads share the same client.
+S3_CLIENT_CONFIG = Config(
+    max_pool_connections=MAX_POOL_CONNECTIONS,
+    tcp_keepalive=True,
+    retries={
+        'mode': 'adaptive',
+        'max_attempts': 10
+    })
+
+# A single boto3 Session shared by all of the clients created by this
+# module, so that the AWS config/credentials files are only parsed (and
+# credentials only resolved) once.
+_SESSION = boto3.session.Session()
+
+# boto3 Sessions are not thread-safe, so creating clients from the shared
+# Session has to be serialized
+_SESSION_LOCK = threading.Lock()
+
+# Boundaries at which the keyspace of a bucket is split into ranges of
+# keys that are listed in parallel by iter_bucket_contents(). They split
+# typical (ASCII) key names into roughly even ranges; keys outside of
+# that character set are still listed, just not spread out as evenly.
+LISTING_PARTITION_BOUNDARIES = tuple('048BFJNRVZcgkosw')
+
+# Maximum number of listed keys waiting to be consumed; once that many have
+# piled up, listing pauses until the consumer catches up.
+MAX_QUEUED_KEYS = 1000
+
+# bucket name -> location (region); a bucket's region never changes, so
+# it only has to be looked up once per run
+_bucket_locations = {}
+
+
+def get_s3_client(region: str = None) -> BaseClient:
+    """Get the shared S3 client for the specified region. The client is
+       created on first use and then reused by all subsequent calls, so
+       that pooled HTTPS connections and credentials are reused as well.
+
+       S3 clients are thread-safe and can be shared between threads.
+
+    Args:
+        region (str, optional): the region the client should send its
+        requests to. Defaults to None (the current region).
+
+    Returns:
+        BaseClient: the S3 client
+    """
+
+    # resolve the default region first, so that e.g. get_s3_client() and
+    # get_s3_client('us-east-1') share the same client when the current
+    # region is us-east-1
+    return _get_s3_client(region or _SESSION.region_name)
+
+
+# one client per region; there are only a few dozen AWS regions in total
+@functools.lru_cache(maxsize=32)
+def _get_s3_client(region: Optional[str]) -> BaseClient:
+    with _SESSION_LOCK:
+        return _SESSION.client('s3', region_name=region, config=S3_CLIENT_CONFIG)
+
 
 def get_new_bucket_name(bucket_prefix: str = None):
     if bucket_prefix:
@@ -17,9 +99,9 @@ def get_new_bucket_name(bucket_prefix: str = None):
 
 # taken from:
 #   https://stackoverflow.com/questions/26871884/how-can-i-easily-determine-if-a-boto-3-s3-bucket-resource-exists
-def check_bucket(s3_resource: ServiceResource, bucket_name: str) -> bool:
+def check_bucket(bucket_name: str) -> bool:
     try:
-        s3_resource.meta.client.head_bucket(Bucket=bucket_name)
+        get_s3_client().head_bucket(Bucket=bucket_name)
         return True
     except botocore.exceptions.ClientError as e:
         return False
@@ -36,22 +118,97 @@ def get_bucket_contents(bucket_name: str, location: str = None) -> list[str]:
         list[str]: a list of files in the specified S3 bucket
     """
 
-    # TODO:
-    #   - look into using list_objects_v2()
+    # The low-level paginated ListObjectsV2 API returns up to 1000 keys
+    # per page as plain dicts; this avoids creating an ObjectSummary
+    # resource for every single object in the bucket.
+    paginator = get_s3_client(location).get_paginator('list_objects_v2')
 
-    s3_resource = None
-    if location:
-        s3_resource = boto3.resource('s3', region_name=location)
-    else:
-        s3_resource = boto3.resource('s3')
+    return [obj['Key']
+            for page in paginator.paginate(Bucket=bucket_name)
+            for obj in page.get('Contents', ())]
 
-    bucket_contents = []
 
-    bucket = s3_resource.Bucket(bucket_name)
-    for obj in bucket.objects.all():
-        bucket_contents.append(obj.key)
+def iter_bucket_contents(bucket_name: str, location: str = None) -> Iterator[str]:
+    """Iterate over the contents of the specified S3 bucket, yielding
+       every key as soon as it has been listed.
+
+       The first page of keys is listed right away. If the bucket holds
+       more keys than that, the remainder of the keyspace is partitioned
+       into ranges of keys which are then listed concurrently. Note that
+       as a result the keys are not yielded in sorted order.
+
+       Listing never runs more than MAX_QUEUED_KEYS keys ahead of the
+       consumer, and stops as soon as the iterator is closed (or garbage
+       collected) before it is exhausted.
+
+    Args:
+        bucket_name (str): name of the S3 bucket
+        location (str): the location (region) the S3 bucket resides in
+
+    Yields:
+        str: the key of each file in the specified S3 bucket
+    """
+
+    s3_client = get_s3_client(location)
+
+    response = s3_client.list_objects_v2(Bucket=bucket_name)
+    keys = [obj['Key'] for obj in response.get('Contents', ())]
+    yield from keys
+
+    if not response.get('IsTruncated'):
+        return
+
+    # Partition i holds the keys k where lower_i < k <= upper_i; the
+    # first partition starts right after the last key listed so far and
+    # the last partition is unbounded. S3 lists keys in UTF-8 byte order,
+    # which is the same as the order of Python's str comparisons.
+    uppers = [boundary for boundary in LISTING_PARTITION_BOUNDARIES if boundary > keys[-1]]
+    partitions = list(zip([keys[-1]] + uppers, uppers + [None]))
+
+    keys_queue = queue.Queue(maxsize=MAX_QUEUED_KEYS)
+    stop = threading.Event()
+    done = object()
+
+    def put(item) -> bool:
+        # (a full queue is waited on in short intervals, so that listing
+        # still notices when it is to stop)
+        while not stop.is_set():
+            try:
+                keys_queue.put(item, timeout=0.1)
+                return True
+            except queue.Full:
+                pass
+        return False
 
-    return bucket_contents
+    def list_partition(lower: str, upper: Optional[str]) -> None:
+        try:
+            paginator = s3_client.get_paginator('list_objects_v2')
+            for page in paginator.paginate(Bucket=bucket_name, StartAfter=lower):
+                for obj in page.get('Contents', ()):
+                    if upper is not None and obj['Key'] > upper:
+                        return
+                    if not put(obj['Key']):
+                        return
+        finally:
+            put(done)
+
+    with ThreadPoolExecutor(max_workers=len(partitions)) as executor:
+        futures = [executor.submit(list_partition, lower, upper) for lower, upper in partitions]
+
+        try:
+            remaining = len(futures)
+            while remaining:
+                key = keys_queue.get()
+                if key is done:
+                    remaining -= 1
+                else:
+                    yield key
+        finally:
+            stop.set()
+
+        # re-raise any error that occurred while listing
+        for future in futures:
+            future.result()
 
 
 def get_bucket_location(bucket_name: str) -> str:
@@ -64,7 +221,11 @@ def get_bucket_location(bucket_name: str) -> str:
         str: the location (region) the bucket resides in
     """
 
-    s3_client = boto3.client('s3')
+    location = _bucket_locations.get(bucket_name)
+    if location:
+        return location
+
+    s3_client = get_s3_client()
     location = s3_client.get_bucket_location(Bucket=bucket_name)['LocationConstraint']
 
     # A peculiarity of the Boto3 library (or of the underlying AWS API)
@@ -76,7 +237,41 @@ def get_bucket_location(bucket_name: str) -> str:
     # https://stackoverflow.com/questions/67370746/what-does-region-none-mean-when-creating-a-aws-s3-bucket/67370874
     #
 
-    return 'us-east-1' if not location else location
+    location = 'us-east-1' if not location else location
+    _bucket_locations[bucket_name] = location
+
+    return location
+
+
+def get_bucket_region(bucket_name: str) -> Optional[str]:
+    """Check that the specified S3 bucket exists and get the location
+       (region) it resides in, using a single HeadBucket request.
+
+       The region is also remembered for subsequent calls to
+       get_bucket_location().
+
+    Args:
+        bucket_name (str): name of the S3 bucket
+
+    Returns:
+        str: the location (region) the bucket resides in, or None if the
+             bucket does not exist or is not accessible
+    """
+
+    try:
+        response = get_s3_client().head_bucket(Bucket=bucket_name)
+    except botocore.exceptions.ClientError as e:
+        return None
+
+    # S3 reports the bucket's region in the x-amz-bucket-region header of
+    # every HeadBucket response
+    location = response['ResponseMetadata']['HTTPHeaders'].get('x-amz-bucket-region')
+    if not location:
+        return get_bucket_location(bucket_name)
+
+    _bucket_locations[bucket_name] = location
+
+    return location
 
 
 def get_current_region() -> str:
@@ -87,8 +282,8 @@ def get_current_region() -> str:
         str: the current region name
     """
 
-    session = boto3.Session()
-    return session.region_name
+    # the shared Session resolved the region when it was created
+    return _SESSION.region_name
 
 
 def is_bucket_empty(bucket_name: str, location: str) -> bool:
@@ -102,16 +297,8 @@ def is_bucket_empty(bucket_name: str, location: str) -> bool:
         bool: True if the S3 bucket is empty, False otherwise
     """
 
-    # TODO:
-    #   consider the following various approaches to determine the
-    #   optimal and most efficient way to determins if the bucket is
-    #   empty:
-    #
-    #   1) https://fuzzyblog.io/blog/aws/2019/10/24/three-ways-to-count-the-objects-in-an-aws-s3-bucket.html
-    #   2) https://stackoverflow.com/questions/54656455/get-count-of-objects-in-a-specific-s3-folder-using-boto3
-    #   3) https://blog.jverkamp.com/2018/07/15/counting-and-sizing-s3-buckets/
-    #   4) https://towardsdatascience.com/working-with-amazon-s3-buckets-with-boto3-785252ea22e0
-
-    contents = get_bucket_contents(bucket_name, location)
+    # Ask for (at most) a single key: this is one LIST request regardless
+    # of how many objects the bucket contains.
+    response = get_s3_client(location).list_objects_v2(Bucket=bucket_name, MaxKeys=1)
 
-    return len(contents) == 0
+    return not response.get('Contents')
@@ -1,17 +1,29 @@
-import boto3
+import argparse
+import asyncio
+import functools
+import importlib.util
+import mmap
 import os
+import queue
 import sys
+import threading
+import time
 
+from collections import deque
+from concurrent.futures import Future, ThreadPoolExecutor
 from datetime import timedelta
+from operator import itemgetter
 from timeit import default_timer as timer
-from tqdm import tqdm
+from typing import Iterable, Iterator, Optional
 from commons import NonExistentS3BucketError
 
 import hash_utils
-import s3_utils
+
+# boto3, s3_utils and tqdm are imported lazily, see s3_utils
+
 
 # TODO
-#   - integrate the argparse module
+#   - [DONE] integrate the argparse module
 #   - integrate the Python std logging module, and log all output to
 #     an ondisk logfile
 #   - when uploading a single file > 50 Mb, display a progress bar
@@ -20,99 +32,524 @@ import s3_utils
 #     user-specified bucket prefix
 #   - when uploading the contents of an entire directory, generate a
 #     manifest file that lists all of the files and their respective
-#     hashes
+#     hashes (so far, only done with --dedup)
 #   - prompt when a file with the same key already exists in the target
 #     bucket, only proceed if the user chooses to overwrite those files
+#     (for now, such files can be skipped with --skip-existing)
 #   - add a verbose mode
-#   - add an optional flag that adds an extra check/verification step to
+#   - [DONE] add an optional flag that adds an extra check/verification step to
 #     verify that a file was successfully uploaded to the bucket. Should
 #     be optional as this will slow down the end-to-end upload time.
+#     (S3 now verifies a checksum of every upload, at no extra cost)
 #   - add an option to recurse into all sub-directories when uploading
 #     files. If not specified, only upload those files in the root of
 #     the specified directory.
-#   - calculate and display the average upload speed (Kb / Mb per second)
+#   - [DONE] calculate and display the average upload speed (Kb / Mb per second)
 #   - add an option to skip (cryptographic) hash generation
 #   - add an option to only upload a certain type of files (e.g. only PDFs,
 #     only .txt files, etc)
 #   - [DONE] convert this into a Class
 #   - [DONE] add total elapsed time logging
+#   - [DONE] upload files concurrently using a pool of worker threads
 #
 
 
+DEFAULT_CONCURRENCY = 16
+
+# Files larger than the multipart threshold are uploaded as concurrent
+# parts of MULTIPART_CHUNKSIZE bytes each, instead of over a single stream.
+MULTIPART_THRESHOLD = 8 * 1024 * 1024
+MULTIPART_CHUNKSIZE = 16 * 1024 * 1024
+MAX_PART_CONCURRENCY = 10
+
+# Files up to this size are read into memory and uploaded with a single
+# PutObject request, bypassing the (thread pool and multipart) machinery of
+# s3transfer altogether.
+PUT_OBJECT_THRESHOLD = 5 * 1024 * 1024
+
+# The checksum S3 verifies every upload against; CRC32C when its (optional)
+# awscrt implementation is available, which is hardware-accelerated on
+# modern CPUs, and CRC32 (zlib) otherwise. Unlike the integrity hash, it
+# only has to detect corruption in transit, so there is no need for the
+# much slower SHA-256 here.
+CHECKSUM_ALGORITHMS = ('CRC32', 'CRC32C', 'SHA1', 'SHA256')
+DEFAULT_CHECKSUM_ALGORITHM = 'CRC32C' if importlib.util.find_spec('awscrt') else 'CRC32'
+
+# How long (in seconds) the result of a successful bucket check is reused
+# for, so that uploaders created over and over again in the same
+# (long-running) process don't each repeat the HeadBucket round-trip.
+BUCKET_CHECK_TTL = 300
+
+# bucket name -> (time of the check, location of the bucket)
+_BUCKET_CHECK_CACHE: dict[str, tuple[float, str]] = {}
+_BUCKET_CHECK_LOCK = threading.Lock()
+
+# maximum number of files queued up for upload at any one time; this keeps
+# memory use bounded, regardless of the number of files in the directory
+MAX_QUEUED_UPLOADS = 1024
+
+
+@functools.lru_cache(maxsize=None)
+def _get_async_session():
+    # aioboto3 is an optional dependency, only needed for --async
+    import aioboto3
+
+    # Like the boto3 Session in s3_utils, a single aioboto3 Session is
+    # shared by all of the async uploads in this process, so that the AWS
+    # config/credentials files are only parsed once.
+    return aioboto3.Session()
+
+
 class S3FileUploader:
     """A utility class to upload files to an existing S3 Bucket. An instance
        of this class is bound to a specified, named S3 bucket at the
        time of instantiation."""
 
-    def __init__(self, bucket_name: str) -> None:
+    def __init__(self, bucket_name: str, concurrency: int = DEFAULT_CONCURRENCY, max_concurrency: Optional[int] = None,
+                 follow_symlinks: bool = False, checksum_algorithm: str = DEFAULT_CHECKSUM_ALGORITHM) -> None:
+        import s3_utils
+        from boto3.s3.transfer import TransferConfig
+
+        # Unless specified, the number of concurrent parts per file is
+        # chosen such that the total number of in-flight PUT requests
+        # (concurrent files x concurrent parts per file) fits within the
+        # connection pool of the single, shared S3 client.
+        if max_concurrency is None:
+            max_concurrency = max(1, min(MAX_PART_CONCURRENCY, s3_utils.MAX_POOL_CONNECTIONS // concurrency))
+
         self.bucket_name = bucket_name
-        self.s3_resource = None
+        self.concurrency = concurrency
+        self.follow_symlinks = follow_symlinks
+        self.checksum_algorithm = checksum_algorithm
+        self.transfer_config = TransferConfig(
+            multipart_threshold=MULTIPART_THRESHOLD,
+            multipart_chunksize=MULTIPART_CHUNKSIZE,
+            max_concurrency=max_concurrency,
+            use_threads=True
+            )
+        self.location = None
+        self.s3_client = None
+
+
+    @staticmethod
+    def _check_bucket(bucket_name: str) -> str:
+        """Check that the specified S3 bucket exists and get its location
+           (region), reusing the result of a recent check if there is one.
+
+           The lock is held across the check itself, so that uploaders
+           initialized concurrently for the same bucket share one request.
+
+        Raises:
+            NonExistentS3BucketError: if the bucket does not exist
+
+        Returns:
+            str: the location (region) the bucket resides in
+        """
+        import s3_utils
+
+        with _BUCKET_CHECK_LOCK:
+            checked_at, location = _BUCKET_CHECK_CACHE.get(bucket_name, (0.0, None))
+            if location and time.monotonic() - checked_at < BUCKET_CHECK_TTL:
+                return location
+
+            # one HeadBucket request both checks that the bucket exists and
+            # resolves its location (region)
+            location = s3_utils.get_bucket_region(bucket_name)
+            if not location:
+                raise NonExistentS3BucketError(bucket_name)
+
+            _BUCKET_CHECK_CACHE[bucket_name] = (time.monotonic(), location)
+
+        return location
 
 
     def initialize(self) -> None:
-        resource = boto3.resource('s3')
+        import s3_utils
+
+        self.location = self._check_bucket(self.bucket_name)
 
-        if not s3_utils.check_bucket(resource, self.bucket_name):
-            raise NonExistentS3BucketError(self.bucket_name)
+        # Unlike resources, S3 clients are thread-safe, so all of the worker
+        # threads share this one (cached) client and its pool of kept-alive
+        # connections. No resource objects are created at all, and the
+        # client talks to the bucket's own region directly.
+        self.s3_client = s3_utils.get_s3_client(self.location)
 
-        self.s3_resource = resource
 
+    @staticmethod
+    def _read_file_and_hash(file_path: str, calc_hash: bool = True) -> tuple[bytes, Optional[str]]:
+        with open(file_path, 'rb') as f:
+            data = f.read()
 
-    def _upload_file_to_s3_bucket(self, file_path: str, calc_hash: bool) -> bool:
+        return data, hash_utils.get_buffer_hash(data) if calc_hash else None
+
+
+    def _upload_mapped_file(self, file_path: str, key: str, extra_args: dict) -> None:
+        # The file is memory-mapped, and the very same pages are fed to both
+        # the hash and the upload; so the file is read from disk just once,
+        # as a single sequential stream, instead of twice.
+        with open(file_path, 'rb') as f, mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as buffer:
+            if hasattr(buffer, 'madvise') and hasattr(mmap, 'MADV_SEQUENTIAL'):
+                buffer.madvise(mmap.MADV_SEQUENTIAL)
+
+            extra_args['Metadata'] = {hash_utils.HASH_ALGORITHM: hash_utils.get_buffer_hash(buffer)}
+
+            self.s3_client.upload_fileobj(buffer, self.bucket_name, key, ExtraArgs=extra_args, Config=self.transfer_config)
+
+
+    def _key_for(self, file_path: str) -> str:
+        """Get the key a file is uploaded under: the name of the file, or of
+           the file a symlink points to if symlinks are followed
+
+        Args:
+            file_path (str): full path to the file
+
+        Returns:
+            str: the key for the file
+        """
+        # Resolving every symlink along the path takes one lstat() call per
+        # path component, so it's only done when symlinks are to be
+        # followed; paths from _iter_files() are never symlinks otherwise.
+        if self.follow_symlinks:
+            file_path = os.path.realpath(file_path)
+
+        return os.path.basename(file_path)
+
+
+    def _upload_file_to_s3_bucket(self, file_path: str, calc_hash: bool, file_size: Optional[int] = None) -> bool:
         """Upload specified file to S3 bucket (internal helper)
 
         Args:
             file_path (str): full path to file to be uploaded
             calc_hash (bool): if True, compute the integrity hash for the file
+            file_size (int): size of the file in bytes, if already known
 
         Returns:
             bool: True if file was uploaded successfully
         """
         success = True
 
-        real_path = os.path.realpath(file_path)
-        filename = os.path.basename(real_path)
+        filename = self._key_for(file_path)
 
-        self.s3_resource.Bucket(self.bucket_name).upload_file(Filename=real_path, Key=filename)
+        # The integrity hash is stored in the object's (user) metadata, so
+        # every file is uploaded with a single request and no separate
+        # .hash file needs to be written, uploaded and deleted again. In
+        # addition, S3 itself verifies a checksum of the uploaded
+        # data, and rejects the upload if it was corrupted in transit.
+        extra_args = {'ChecksumAlgorithm': self.checksum_algorithm}
 
-        if calc_hash:
-            # TODO
-            #   - instead of uploading a separate .hash file for each data file
-            #     being uploaded, consider using the Object Metadata
-            #   - and store the computed hash in a custom Key-Value pair in this
-            #     Object Metadata
-            hash_filepath = hash_utils.create_integrity_hash_file(file_path)
+        if file_size is None:
+            file_size = os.path.getsize(file_path)
 
-            self.s3_resource.Bucket(self.bucket_name).upload_file(Filename=real_path + ".hash", Key=filename + ".hash")
+        if file_size <= PUT_OBJECT_THRESHOLD:
+            data, file_hash = self._read_file_and_hash(file_path, calc_hash)
+            if calc_hash:
+                extra_args['Metadata'] = {hash_utils.HASH_ALGORITHM: file_hash}
 
-            try:
-                os.remove(hash_filepath)
-            except:
-                print(f'ERROR: unable to delete integrity hash file {hash_filepath}')
+            self.s3_client.put_object(Bucket=self.bucket_name, Key=filename, Body=data, **extra_args)
+        elif calc_hash:
+            self._upload_mapped_file(file_path, filename, extra_args)
+        else:
+            self.s3_client.upload_file(Filename=file_path, Bucket=self.bucket_name, Key=filename, ExtraArgs=extra_args, Config=self.transfer_config)
 
         return success
 
 
-    def upload_dir_contents(self, dir_path: str) -> int:
-        """Upload all of the files contained in a directory to the S3 bucket
+    @staticmethod
+    def _iter_files(root: str, follow_symlinks: bool = False) -> Iterator[tuple[str, int]]:
+        """Yield the path and size of every file within a directory tree
+
+        The tree is traversed with os.scandir(): each DirEntry already knows
+        whether it is a file or a directory, so unlike os.walk() no extra
+        stat() call is needed per entry. Sub-directories are visited via an
+        explicit queue rather than by recursion, so that deeply nested trees
+        can't run into the recursion limit. Like os.walk(), a directory that
+        can't be read is skipped (with a warning) rather than aborting the
+        whole traversal.
+
+        Within each directory, the largest files are yielded first: their
+        (multipart) uploads take the longest, so starting them early lets
+        the many smaller uploads fill in around them instead of leaving a
+        long tail.
 
         Args:
-            dir_path (str): full path to the directory
+            root (str): full path to the directory
+            follow_symlinks (bool): if True, include symlinks to files as well
+                                    (symlinks to directories are never followed)
+
+        Yields:
+            tuple[str, int]: full path to each file, and its size in bytes
+        """
+        from tqdm import tqdm
+
+        dirs = deque([root])
+        while dirs:
+            dir_path = dirs.popleft()
+            files = []
+            try:
+                with os.scandir(dir_path) as it:
+                    for entry in it:
+                        if entry.is_file(follow_symlinks=follow_symlinks):
+                            files.append((entry.path, entry.stat(follow_symlinks=follow_symlinks).st_size))
+                        elif entry.is_dir(follow_symlinks=False):
+                            dirs.append(entry.path)
+            except OSError as e:
+                tqdm.write(f'WARNING: skipping directory {dir_path}: {e.strerror}', file=sys.stderr)
+
+            files.sort(key=itemgetter(1), reverse=True)
+            yield from files
+
+
+    def _existing_keys(self, prefix: str = '') -> set:
+        """Get the keys of all objects in the S3 bucket (directly) under the
+           specified prefix
+
+        Args:
+            prefix (str): the key prefix, e.g. 'photos/'
 
         Returns:
-            int: number of files successfully uploaded
+            set: the keys of the objects
+        """
+        # A single ListObjects request returns up to 1000 keys, whereas
+        # checking for the files one at a time would take one HeadObject
+        # request per file. The delimiter leaves out all keys nested any
+        # deeper, which uploaded files never collide with.
+        paginator = self.s3_client.get_paginator('list_objects_v2')
+        return {
+            obj['Key']
+            for page in paginator.paginate(Bucket=self.bucket_name, Prefix=prefix, Delimiter='/')
+            for obj in page.get('Contents', [])
+            }
+
+
+    def _collect_upload_result(self, future: Future, file: tuple[str, int], progress_bar) -> int:
+        """Collect the result of an upload that has completed; this is only
+           ever called from the main thread.
+
+        Returns:
+            int: 1 if the file was uploaded successfully, 0 otherwise
+        """
+        file_path, file_size = file
+
+        uploaded = future.result()
+        progress_bar.update(file_size)
+        progress_bar.write(os.path.basename(file_path))
+        return 1 if uploaded else 0
+
+
+    def _upload_files(self, files: Iterable[tuple[str, int]], progress_bar) -> int:
+        files_uploaded = 0
+
+        # Upload all files in the specified directory to this S3 bucket
+        # using a pool of worker threads; each file's integrity hash is
+        # computed within its worker as well, overlapping with the uploads
+        # of other files. hashlib releases the GIL while hashing, so the
+        # hashing itself runs on multiple CPU cores at once too, without
+        # the need for a pool of processes (nor for having to share the
+        # file contents and S3 clients between them).
+        #
+        # Every file is submitted for upload as soon as it has been found,
+        # so the first uploads don't have to wait for the whole directory
+        # tree to be traversed. Completed futures are handed back to the
+        # main thread through this queue, so the progress bar doesn't need
+        # any locking.
+        completed = queue.SimpleQueue()
+        pending = 0
+
+        with ThreadPoolExecutor(max_workers=self.concurrency) as executor:
+            try:
+                for file in files:
+                    future = executor.submit(self._upload_file_to_s3_bucket, file[0], True, file[1])
+                    future.add_done_callback(lambda future, file=file: completed.put((future, file)))
+                    pending += 1
+                    progress_bar.total += file[1]
+
+                    # collect whatever has completed while traversal carries on;
+                    # and once too many files are queued up, wait for uploads to
+                    # complete before submitting any more
+                    while pending >= MAX_QUEUED_UPLOADS or not completed.empty():
+                        files_uploaded += self._collect_upload_result(*completed.get(), progress_bar)
+                        pending -= 1
+
+                while pending:
+                    files_uploaded += self._collect_upload_result(*completed.get(), progress_bar)
+                    pending -= 1
+            except BaseException:
+                # the first failed upload stops the traversal, and is reported
+                # without waiting for all of the queued uploads to complete
+                # first (only for those that are already in progress)
+                executor.shutdown(cancel_futures=True)
+                raise
+
+        return files_uploaded
+
+
+    def _upload_file_chunks(self, file_path: str, file_size: int, existing_chunks: set, lock: threading.Lock) -> dict:
+        """Upload those content-defined chunks of a file that aren't in the
+           S3 bucket yet (internal helper)
+
+        Args:
+            file_path (str): full path to file to be uploaded
+            file_size (int): size of the file in bytes
+            existing_chunks (set): keys of the chunks already in the bucket;
+                                   shared by all workers, guarded by lock
+            lock (threading.Lock): the lock guarding existing_chunks
+
+        Returns:
+            dict: the manifest entry for the file
         """
+        chunk_keys = []
+
+        # (an empty file can't be memory-mapped, but it has no chunks either)
+        with open(file_path, 'rb') as f, \
+             (mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) if file_size else memoryview(b'')) as buffer:
+            file_hash = hash_utils.get_buffer_hash(buffer)
+
+            for start, end in hash_utils.cdc_chunks(buffer):
+                chunk = buffer[start:end]
+                chunk_key = hash_utils.CHUNK_KEY_PREFIX + hash_utils.get_buffer_hash(chunk, hash_utils.CHUNK_HASH_ALGORITHM)
+                chunk_keys.append(chunk_key)
+
+                # a chunk that is shared by several files being uploaded at
+                # the same time is still only uploaded once
+                with lock:
+                    is_new_chunk = chunk_key not in existing_chunks
+                    existing_chunks.add(chunk_key)
+
+                if is_new_chunk:
+                    self.s3_client.put_object(Bucket=self.bucket_name, Key=chunk_key, Body=chunk, ChecksumAlgorithm=self.checksum_algorithm,
+                                              Metadata={hash_utils.DEDUP_METADATA_KEY: hash_utils.DEDUP_CHUNK})
+
+        return {'size': file_size, 'algorithm': hash_utils.HASH_ALGORITHM, 'hash': file_hash, 'chunks': chunk_keys}
+
+
+    def _upload_files_dedup(self, files: list[tuple[str, int]], progress_bar, manifest_key: str) -> int:
+        # Each file is split into content-defined chunks, and stored in the
+        # bucket as nothing but a list of the keys of its chunks (in the
+        # manifest); each chunk is stored under a key derived from its hash.
+        # So a chunk that is already stored in the bucket (from an earlier
+        # upload of the same, or a similar, file) doesn't have to be uploaded
+        # again. Finding the chunk boundaries is done in pure Python though,
+        # at just a few MB/s, so this only pays off when the bandwidth to S3
+        # rather than the CPU is the bottleneck.
+        existing_chunks = self._existing_keys(hash_utils.CHUNK_KEY_PREFIX)
+        lock = threading.Lock()
+
+        manifest = {}
+        with ThreadPoolExecutor(max_workers=self.concurrency) as executor:
+            results = executor.map(lambda file: self._upload_file_chunks(file[0], file[1], existing_chunks, lock), files)
+            for (file_path, file_size), entry in zip(files, results):
+                manifest[self._key_for(file_path)] = entry
+                progress_bar.update(file_size)
+                progress_bar.write(os.path.basename(file_path))
+
+        # the manifest is uploaded last, once all of the chunks it refers to
+        # are in the bucket
+        self.s3_client.put_object(Bucket=self.bucket_name, Key=manifest_key, Body=hash_utils.create_manifest(manifest).encode(),
+                                  ChecksumAlgorithm=self.checksum_algorithm,
+                                  Metadata={hash_utils.DEDUP_METADATA_KEY: hash_utils.DEDUP_MANIFEST})
+
+        return len(manifest)
+
+
+    async def _upload_file_async(self, s3_client, semaphore: asyncio.Semaphore, file_path: str, file_size: int) -> tuple[str, int]:
+        async with semaphore:
+            filename = self._key_for(file_path)
+            extra_args = {'ChecksumAlgorithm': self.checksum_algorithm}
+
+            # Reading and hashing the file are blocking operations, and are
+            # run on the default thread pool to keep them off the event loop
+            loop = asyncio.get_running_loop()
+            if file_size <= PUT_OBJECT_THRESHOLD:
+                # a small file is read (and hashed) just once, and uploaded
+                # with a single PutObject request
+                data, file_hash = await loop.run_in_executor(None, self._read_file_and_hash, file_path)
+                extra_args['Metadata'] = {hash_utils.HASH_ALGORITHM: file_hash}
+                await s3_client.put_object(Bucket=self.bucket_name, Key=filename, Body=data, **extra_args)
+            else:
+                file_hash = await loop.run_in_executor(None, hash_utils.get_hash, file_path)
+                extra_args['Metadata'] = {hash_utils.HASH_ALGORITHM: file_hash}
+                await s3_client.upload_file(file_path, self.bucket_name, filename, ExtraArgs=extra_args, Config=self.transfer_config)
+
+        return file_path, file_size
+
+
+    async def _upload_files_async(self, files: list[tuple[str, int]], progress_bar) -> int:
+        import s3_utils
+
         files_uploaded = 0
 
-        # Iterate over all files in the specified directory and upload
-        # them to this S3 bucket
-        # TODO: replace os.walk() with os.scandir()
-        for subdir, dirs, files in os.walk(dir_path):
-            for filename in (progress_bar := tqdm(files, desc='Uploading files')):
-                file_path = subdir + os.sep + filename
-                self._upload_file_to_s3_bucket(file_path, True)
+        # Uploads of small files are bound by network latency rather than
+        # bandwidth; as coroutines on a single thread, many more of them
+        # can be in flight at once than with a pool of worker threads.
+        async with _get_async_session().client('s3', region_name=self.location, config=s3_utils.S3_CLIENT_CONFIG) as s3_client:
+            # at most as many uploads are in flight as the client has
+            # pooled connections
+            semaphore = asyncio.Semaphore(s3_utils.MAX_POOL_CONNECTIONS)
+            tasks = [
+                asyncio.create_task(self._upload_file_async(s3_client, semaphore, file_path, file_size))
+                for file_path, file_size in files
+                ]
+
+            for task in asyncio.as_completed(tasks):
+                file_path, file_size = await task
                 files_uploaded += 1
-                progress_bar.write(filename)
+                progress_bar.update(file_size)
+                progress_bar.write(os.path.basename(file_path))
+
+        return files_uploaded
+
+
+    def upload_dir_contents(self, dir_path: str, skip_existing: bool = False, use_async: bool = False, dedup: bool = False) -> int:
+        """Upload all of the files contained in a directory to the S3 bucket
+
+        Args:
+            dir_path (str): full path to the directory
+            skip_existing (bool): if True, don't upload those files that
+                                  already exist in the S3 bucket
+            use_async (bool): if True, upload the files concurrently using
+                              asyncio (requires aioboto3) instead of a pool
+                              of worker threads
+            dedup (bool): if True, only upload those (content-defined)
+                          chunks of the files that aren't in the S3 bucket
+                          yet, along with a manifest named after the
+                          directory; skip_existing and use_async don't
+                          apply then
+
+        Returns:
+            int: number of files successfully uploaded
+        """
+        from tqdm import tqdm
+
+        files = self._iter_files(dir_path, self.follow_symlinks)
+
+        if skip_existing and not dedup:
+            existing_keys = self._existing_keys()
+            files = ((file_path, file_size) for file_path, file_size in files if self._key_for(file_path) not in existing_keys)
+
+        # File sizes can easily vary by orders of magnitude, so progress
+        # (and the transfer rate) is tracked in bytes rather than in files.
+        # The files are uploaded while the directory tree is still being
+        # traversed, so the total grows as more files are found.
+        with tqdm(total=0, unit='B', unit_scale=True, unit_divisor=1024, desc='Uploading files') as progress_bar:
+            if dedup or use_async:
+                # these need the complete list of files up front
+                files = list(files)
+                progress_bar.total = sum(file_size for _, file_size in files)
+
+            if dedup:
+                manifest_key = os.path.basename(os.path.normpath(dir_path)) + hash_utils.MANIFEST_SUFFIX
+                files_uploaded = self._upload_files_dedup(files, progress_bar, manifest_key)
+            elif use_async:
+                files_uploaded = asyncio.run(self._upload_files_async(files, progress_bar))
+            else:
+                files_uploaded = self._upload_files(files, progress_bar)
+
+            elapsed_time = progress_bar.format_dict['elapsed']
+            total_bytes = progress_bar.n
+
+        if elapsed_time > 0:
+            average_rate = tqdm.format_sizeof(total_bytes / elapsed_time, 'B/s', 1024)
+            print(f'Average upload speed: {average_rate}')
 
         return files_uploaded
 
@@ -128,19 +565,20 @@ class S3FileUploader:
         print(f"Done.")
 
 
-def main(dir_path: str, s3_bucket_name: str, is_file: bool) -> None:
-    file_uploader = S3FileUploader(s3_bucket_name)
+def main(args: argparse.Namespace) -> None:
+    file_uploader = S3FileUploader(args.s3_bucket_name, args.concurrency, follow_symlinks=args.follow_symlinks,
+                                   checksum_algorithm=args.checksum_algorithm)
     try:
         file_uploader.initialize()
     except NonExistentS3BucketError as e:
-        print(f'ERROR: cannot upload file(s) to non-existent S3 bucket ({s3_bucket_name})', file=sys.stderr)
+        print(f'ERROR: cannot upload file(s) to non-existent S3 bucket ({args.s3_bucket_name})', file=sys.stderr)
         sys.exit(2)
 
     start = timer()
-    if is_file:
-        file_uploader.upload_file(dir_path)
+    if os.path.isfile(args.path):
+        file_uploader.upload_file(args.path)
     else:
-        files_uploaded = file_uploader.upload_dir_contents(dir_path)
+        files_uploaded = file_uploader.upload_dir_contents(args.path, args.skip_existing, args.use_async, args.dedup)
         print(f'{files_uploaded} files uploaded successfully')
     end = timer()
 
@@ -149,16 +587,85 @@ def main(dir_path: str, s3_bucket_name: str, is_file: bool) -> None:
 
 
 if __name__ == "__main__":
-    if (len(sys.argv) < 3):
-        print(f'Usage: {sys.argv[0]} <directory path> <S3 bucket name>', file=sys.stderr)
-        sys.exit(1)
-
-    fs_path = sys.argv[1]
-
-    is_file = os.path.isfile(fs_path)
-
-    if not is_file and not os.path.isdir(fs_path):
-        print(f'ERROR: invalid or non-existent path {fs_path} to upload to AWS S3 bucket', file=sys.stderr)
+    arg_parser = argparse.ArgumentParser(
+        description='Script to upload a file, or the contents of a directory, to an S3 Bucket')
+
+    arg_parser.add_argument(
+        'path',
+        type=str,
+        help='path to the file or directory to upload'
+        )
+
+    arg_parser.add_argument(
+        's3_bucket_name',
+        type=str,
+        help='name of the S3 Bucket'
+        )
+
+    arg_parser.add_argument(
+        '--skip-existing',
+        required=False,
+        action='store_true',
+        help='skip those files that already exist in the S3 Bucket'
+        )
+
+    arg_parser.add_argument(
+        '--follow-symlinks',
+        required=False,
+        action='store_true',
+        help='also upload the files that symlinks point to, named after those files'
+        )
+
+    arg_parser.add_argument(
+        '--async',
+        dest='use_async',
+        required=False,
+        action='store_true',
+        help='upload the contents of a directory using asyncio, which suits many small files best (requires aioboto3)'
+        )
+
+    arg_parser.add_argument(
+        '--dedup',
+        required=False,
+        action='store_true',
+        help='split the files into content-defined chunks, and only upload the chunks not already in the S3 Bucket'
+        )
+
+    arg_parser.add_argument(
+        '--checksum-algorithm',
+        action='store',
+        required=False,
+        choices=CHECKSUM_ALGORITHMS,
+        default=DEFAULT_CHECKSUM_ALGORITHM,
+        help=f'checksum S3 verifies every upload against (default: {DEFAULT_CHECKSUM_ALGORITHM})'
+        )
+
+    arg_parser.add_argument(
+        '--concurrency',
+        action='store',
+        metavar='N',
+        required=False,
+        type=int,
+        default=DEFAULT_CONCURRENCY,
+        help=f'number of files to upload in parallel (default: {DEFAULT_CONCURRENCY})'
+        )
+
+    args = arg_parser.parse_args()
+
+    if args.concurrency < 1:
+        arg_parser.error('--concurrency must be a positive integer')
+
+    if args.dedup and (args.skip_existing or args.use_async):
+        arg_parser.error('--dedup cannot be combined with --skip-existing or --async')
+
+    if args.checksum_algorithm == 'CRC32C' and not importlib.util.find_spec('awscrt'):
+        arg_parser.error('--checksum-algorithm CRC32C requires the awscrt package (pip install awscrt)')
+
+    if args.use_async and not importlib.util.find_spec('aioboto3'):
+        arg_parser.error('--async requires the aioboto3 package (pip install aioboto3)')
+
+    if not os.path.isfile(args.path) and not os.path.isdir(args.path):
+        print(f'ERROR: invalid or non-existent path {args.path} to upload to AWS S3 bucket', file=sys.stderr)
         sys.exit(1)
 
-    main(fs_path, sys.argv[2], is_file)
+    main(args)